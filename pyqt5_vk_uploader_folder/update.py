@@ -1,115 +1,642 @@
 import sys
 import os
 import json
+import io
 import zipfile
+import zlib
 import shutil
 import stat
-import requests
+import struct
+import subprocess
 import time
-from pathlib import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QProgressBar, QApplication, QPushButton, QSizePolicy
 )
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, Qt
 from PyQt5.QtGui import QFont
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Битый архив может проявиться не только как BadZipFile (CRC), но и как ошибка inflate
+# или преждевременный конец потока — всё это повод скачать архив заново
+CORRUPT_ZIP_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError)
+
+# Если установлен python-isal — zipfile распаковывает через ISA-L (в разы быстрее zlib)
+try:
+    from isal import isal_zlib
+    zipfile.zlib = isal_zlib
+    CORRUPT_ZIP_ERRORS += (isal_zlib.error,)
+except ImportError:
+    pass
+
 VERSION_FILE = "version"
+UPDATE_JSON_CACHE = ".update_json.cache"
 UPDATE_JSON_URL = "https://raw.githubusercontent.com/Ilya0khiriv/updater_zero/main/pyqt5_vk_uploader_folder/update.json"
+COPY_BUFSIZE = 256 * 1024
+# Локальный заголовок ZIP: сигнатура, версии, флаги, метод, время, дата, CRC, размеры, длины имени/extra
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+DOWNLOAD_CHUNK_MIN = 64 * 1024
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_CHUNK_MAX = 1024 * 1024
+RANGE_CONNECTIONS = 4
+RANGE_MIN_SIZE = 4 * 1024 * 1024  # меньшие файлы не стоит делить на части
+RANGE_CHUNK_MIN = 1024 * 1024
+RANGE_CHUNKS_PER_CONN = 8
+RANGE_ATTEMPTS = 3  # сколько раз перезапрашиваем оборванный кусок
+EXTRACT_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+PROGRESS_INTERVAL_NS = 100_000_000  # не больше 10 перерисовок прогресса в секунду
+SPEED_SAMPLE_SHIFT = 18  # скорость пересчитываем на каждых 256 КиБ, а не на каждом чанке
+SLOW_SPEED_KBPS = 200
+PREFETCH_DEPTH = 2  # сколько архивов вперёд держим скачанными
+REMOVE_ATTEMPTS = 3
+NATIVE_RMTREE_MIN_ENTRIES = 1000  # меньшие деревья удаляем сами: запуск rm дороже
+# O_BINARY: на Windows без него fd открывается в текстовом режиме
+TEMP_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+# Общая сессия: keep-alive между update.json, Yandex API и самой загрузкой.
+# requests импортируется лениво, уже в фоновом потоке, чтобы не тормозить старт окна
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(
+                pool_connections=8, pool_maxsize=16,
+                max_retries=Retry(total=3, backoff_factor=0.3,
+                                  status_forcelist=[502, 503, 504], raise_on_status=False),
+            ))
+            SESSION = session
+        return SESSION
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+# Итеративное удаление дерева через os.scandir (тип записи берётся из кэша DirEntry)
+def iter_rmtree(root):
+    def retry_writable(func, p):
+        try:
+            func(p)
+        except PermissionError:
+            if os.name != 'nt':
+                raise
+            os.chmod(p, stat.S_IWRITE)
+            func(p)
+
+    stack = [root]
+    visited = []
+    while stack:
+        current = stack.pop()
+        visited.append(current)
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    retry_writable(os.unlink, entry.path)
+
+    for p in reversed(visited):
+        retry_writable(os.rmdir, p)
+
+
+# Есть ли в дереве хотя бы limit записей; обход останавливается на пороге
+def has_many_entries(root, limit=NATIVE_RMTREE_MIN_ENTRIES):
+    count = 0
+    stack = [root]
+    try:
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    count += 1
+                    if count >= limit:
+                        return True
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+    except OSError:
+        return False  # ошибку покажет iter_rmtree
+    return False
+
+
+# Большие деревья на POSIX удаляет rm -rf — намного быстрее поштучного удаления.
+# На Windows только iter_rmtree: cmd.exe по-своему разбирает &, ^ и % в пути
+def fast_rmtree(path):
+    if os.name != 'nt' and has_many_entries(path):
+        try:
+            subprocess.run(['rm', '-rf', '--', path], capture_output=True, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"[VERBOSE] rm -rf failed for {path}, using iter_rmtree: {e}")
+    if os.path.lexists(path):
+        iter_rmtree(path)
 
 
-def force_remove(path):
-    def handle_remove_readonly(func, p, exc_info):
-        os.chmod(p, stat.S_IWRITE)
-        func(p)
-
+# Удаление файла/папки; заблокированный файл пробуем снять несколько раз, затем ошибка
+def force_remove(path, attempts=REMOVE_ATTEMPTS):
     path = os.path.abspath(path)
-    if os.path.isfile(path):
+    for attempt in range(attempts):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        except IsADirectoryError:
+            fast_rmtree(path)
+            return
+        except PermissionError:
+            # macOS/Windows отдают PermissionError на unlink() папки
+            if os.path.isdir(path):
+                fast_rmtree(path)
+                return
+            # POSIX: для unlink важны права на родительскую папку — chmod и повтор не помогут
+            if os.name != 'nt' or attempt == attempts - 1:
+                raise
+            # Атрибут «только чтение» или временная блокировка (антивирус, завершающийся процесс)
+            try:
+                os.chmod(path, stat.S_IWRITE)
+            except OSError:
+                pass
+            time.sleep(0.05 * (1 << attempt))
+            continue
+        return
+
+
+# Удаление списка файлов: несколько unlink одновременно (на Windows каждый — миллисекунды)
+def remove_files(cwd, names, workers=EXTRACT_WORKERS):
+    def remove_one(name):
         try:
-            os.chmod(path, stat.S_IWRITE)
-            os.remove(path)
+            force_remove(safe_join(cwd, name))
         except Exception as e:
-            print(f"[VERBOSE] Failed to remove file {path}: {e}")
-            shutil.rmtree(os.path.dirname(path), onerror=handle_remove_readonly)
-    elif os.path.isdir(path):
-        shutil.rmtree(path, onerror=handle_remove_readonly)
+            print(f"[VERBOSE] Не удалось удалить файл {name}: {e}")
+
+    if workers > 1 and len(names) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(remove_one, names))
+    else:
+        for name in names:
+            remove_one(name)
+
+
+# STORED-элемент копируется ядром (sendfile) из архива в файл; False — если нельзя
+def copy_stored(zipf, zip_info, dst):
+    if (zip_info.compress_type != zipfile.ZIP_STORED or zip_info.flag_bits & 0x1
+            or not hasattr(os, 'sendfile') or not hasattr(os, 'pread')):
+        return False
+    try:
+        src_fd = zipf.fp.fileno()
+    except (AttributeError, OSError):
+        return False
+
+    # Данные идут после локального заголовка со своими длинами имени и extra-поля
+    header = os.pread(src_fd, LOCAL_HEADER.size, zip_info.header_offset)
+    fields = LOCAL_HEADER.unpack(header)
+    if fields[0] != b'PK\x03\x04':
+        return False
+    offset = zip_info.header_offset + LOCAL_HEADER.size + fields[9] + fields[10]
+
+    remaining = zip_info.file_size
+    dst_fd = dst.fileno()
+    while remaining:
+        try:
+            sent = os.sendfile(dst_fd, src_fd, offset, remaining)
+        except (OSError, io.UnsupportedOperation):
+            # macOS: sendfile пишет только в сокеты — копируем через zipfile
+            if remaining != zip_info.file_size:
+                raise
+            return False
+        if not sent:
+            raise EOFError(f"Обрезанный элемент архива: {zip_info.filename}")
+        offset += sent
+        remaining -= sent
+    return True
+
+
+# Резервируем место под файл целиком (меньше фрагментации и обновлений метаданных);
+# где posix_fallocate нет (Windows, macOS) — просто задаём размер
+def preallocate(f, size):
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        f.truncate(size)
+
+
+# Файл на диске уже совпадает с элементом архива (размер + CRC32) — перезаписывать незачем
+def is_unchanged(dest, zip_info):
+    try:
+        if os.stat(dest).st_size != zip_info.file_size:
+            return False
+        crc = 0
+        with open(dest, 'rb', buffering=0) as f:
+            while chunk := f.read(COPY_BUFSIZE):
+                crc = zlib.crc32(chunk, crc)
+    except OSError:
+        return False
+    return crc == zip_info.CRC
+
+
+# Временный файл рядом с dest под уникальным скрытым именем. Права 0666 — umask
+# применяет ядро, как при обычном open() (mkstemp создал бы 0600)
+def create_temp(dest):
+    head, name = os.path.split(dest)
+    while True:
+        tmp = os.path.join(head, f".{name}.{os.urandom(4).hex()}.tmp")
+        try:
+            return os.open(tmp, TEMP_FLAGS, 0o666), tmp
+        except FileExistsError:
+            continue
+
+
+# Пишет элемент архива прямо в dest, перезаписывая существующий файл
+def stream_extract(zipf, zip_info, dest):
+    # Неизменённый файл не переписываем: чтение дешевле записи
+    if is_unchanged(dest, zip_info):
+        return
+
+    # Пишем рядом во временный файл и атомарно подменяем: целевой файл никогда не бывает недописанным.
+    # Уникальное скрытое имя: параллельные потоки не пишут в один файл, даже если в архиве
+    # есть и x, и x.new, а остаток после аварийного завершения не похож на файл проекта
+    fd, tmp = create_temp(dest)
+    try:
+        with open(fd, 'wb', buffering=0) as dst:
+            if not copy_stored(zipf, zip_info, dst):
+                with zipf.open(zip_info) as src:
+                    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+        # Права остаются как у прежнего файла — как при записи поверх него
+        try:
+            shutil.copymode(dest, tmp)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp, dest)
+        except PermissionError:
+            # Файл только для чтения (Windows) — удаляем и пробуем ещё раз
+            force_remove(dest)
+            os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+# Проверка архива до любых изменений: каждый элемент читается до конца,
+# ZipExtFile сверяет CRC на EOF и бросает BadZipFile при расхождении.
+# Ошибки inflate и обрыв потока тоже означают битый архив — приводим их к BadZipFile
+def verify_members(zipf, infos):
+    for zip_info in infos:
+        if zip_info.is_dir():
+            continue
+        try:
+            with zipf.open(zip_info) as src:
+                while src.read(COPY_BUFSIZE):
+                    pass
+        except zipfile.BadZipFile:
+            raise
+        except CORRUPT_ZIP_ERRORS as e:
+            raise zipfile.BadZipFile(f"Битый элемент архива {zip_info.filename}: {e}") from e
+
+
+# Параллельная распаковка: у каждого потока свой ZipFile (ZipFile не потокобезопасен)
+def extract_members(zip_path, members, workers=EXTRACT_WORKERS, on_done=None):
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract_one(zip_info, dest):
+        zipf = getattr(local, 'zipf', None)
+        if zipf is None:
+            zipf = local.zipf = zipfile.ZipFile(zip_path, 'r')
+            with handles_lock:
+                handles.append(zipf)
+        try:
+            stream_extract(zipf, zip_info, dest)
+        except Exception as e:
+            print(f"[VERBOSE] Ошибка при извлечении {zip_info.filename}: {e}")
+            raise
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # Сначала крупные файлы — чтобы большой файл не остался последним в очереди
+        members = sorted(members, key=lambda m: m[0].file_size, reverse=True)
+        futures = [pool.submit(extract_one, zip_info, dest) for zip_info, dest in members]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()  # если не удалось — считаем обновление битым
+            if on_done:
+                on_done(done)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for zipf in handles:
+            zipf.close()
+
+
+# fsync папки: сохраняет на диске её записи (переименования, новые файлы). На Windows не нужен
+def fsync_dir(path):
+    if os.name == 'nt':
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # не все файловые системы позволяют fsync папки
+    finally:
+        os.close(fd)
+
+
+# Атомарная запись версии: при сбое файл не останется пустым.
+# dirs — папки, куда распаковка переименовывала файлы: их fsync'аем до записи версии,
+# чтобы новая версия не оказалась на диске раньше самих файлов
+def write_version(version, dirs=()):
+    for dir_path in dirs:
+        fsync_dir(dir_path)
+    tmp = VERSION_FILE + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, str(version).encode('utf-8'))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, VERSION_FILE)
+    fsync_dir(os.path.dirname(os.path.abspath(VERSION_FILE)))
+
+
+# Путь из архива/метаданных относительно cwd; всё, что выходит за его пределы — ошибка
+def safe_join(cwd, name):
+    path = os.path.normpath(os.path.join(cwd, name))
+    prefix = cwd if cwd.endswith(os.sep) else cwd + os.sep
+    if not (path == cwd or path.startswith(prefix)):
+        raise ValueError(f"Путь вне рабочей директории: {name}")
+    return path
+
+
+# Кэш update.json для условного GET (ETag / Last-Modified)
+def load_update_json_cache():
+    try:
+        with open(UPDATE_JSON_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_update_json_cache(response, data):
+    cache = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "data": data,
+    }
+    if not (cache["etag"] or cache["last_modified"]):
+        return
+    try:
+        tmp = UPDATE_JSON_CACHE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp, UPDATE_JSON_CACHE)
+    except OSError as e:
+        print(f"[VERBOSE] Не удалось сохранить кэш update.json: {e}")
+
+
+# JSON из архива: orjson, если установлен, иначе потоковый json.load
+def read_json_member(zipf, zip_info):
+    if orjson is not None:
+        return orjson.loads(zipf.read(zip_info))
+    with zipf.open(zip_info) as f:
+        return json.load(io.TextIOWrapper(f, encoding='utf-8'))
+
+
+# Применение одного архива обновления (без Qt — вызывается из ApplyWorker).
+# on_progress(done, total) вызывается по мере распаковки, не чаще раза на процент
+def apply_hard_update(zip_path, target_version, on_progress=None):
+    cwd = os.getcwd()
+    with zipfile.ZipFile(zip_path, 'r') as zipf:
+        # Центральный каталог разбираем один раз: индекс по имени и поиск снапшота
+        # в порядке расположения в файле — проверка читает архив последовательно
+        infos = sorted(zipf.infolist(), key=lambda zi: zi.header_offset)
+        by_name = {}
+        snapshot_file = None
+        for zi in infos:
+            by_name[zi.filename] = zi
+            if (snapshot_file is None and zi.filename.startswith('snapshot_')
+                    and zi.filename.endswith('.json')):
+                snapshot_file = zi.filename
+
+        if 'update_metadata.json' not in by_name:
+            raise ValueError("Архив обновления повреждён: отсутствует update_metadata.json")
+
+        metadata = read_json_member(zipf, by_name['update_metadata.json'])
+
+        # Битый архив отбрасываем до удаления чего-либо
+        verify_members(zipf, infos)
+
+    # --- Удаление старых файлов и папок ---
+    remove_files(cwd, metadata.get('deleted_files', []))
+
+    # Сначала самые глубокие — удаление родителя не обходит заново уже удалённое
+    deleted_dirs = sorted(metadata.get('deleted_dirs', []),
+                          key=lambda d: os.path.normpath(d).count(os.sep), reverse=True)
+    for dir_path in deleted_dirs:
+        try:
+            force_remove(safe_join(cwd, dir_path))
+        except Exception as e:
+            print(f"[VERBOSE] Не удалось удалить папку {dir_path}: {e}")
 
+    # --- Извлечение новых файлов ---
+    members = []
+    dirs = set()
+    for zip_info in infos:
+        filename = zip_info.filename
 
-class UpdateWorker(QThread):
-    finished = pyqtSignal(list, str)  # Now emits list of updates
-    current_version_fetched = pyqtSignal(int)
+        # Пропускаем метафайлы
+        if filename in ('update_metadata.json', snapshot_file or ''):
+            continue
 
-    def run(self):
-        print("[VERBOSE] Starting update check (fetching from GitHub)...")
-        current_version = 0
+        # 🔒 Пропускаем всё, что содержит скрытые/системные компоненты пути
+        if any(part.startswith('.') for part in filename.split('/')):
+            print(f"[VERBOSE] Пропущен скрытый путь: {filename}")
+            continue
+
+        # Защита от path traversal
         try:
-            if os.path.exists(VERSION_FILE):
-                with open(VERSION_FILE, "r") as f:
-                    current_version = int(f.read().strip() or "0")
-                print(f"[VERBOSE] Current version: {current_version}")
-            else:
-                print("[VERBOSE] No version file. Assuming version 0.")
-            self.current_version_fetched.emit(current_version)
+            target = safe_join(cwd, filename)
+        except ValueError:
+            print(f"[WARN] Подозрительный путь вне рабочей директории: {filename}")
+            continue
+
+        if zip_info.is_dir():
+            dirs.add(target)
+        else:
+            dirs.add(os.path.dirname(target))
+            members.append((zip_info, target))
+
+    # Каждую папку создаём один раз, от корня вглубь
+    for dir_path in sorted(dirs, key=lambda d: d.count(os.sep)):
+        os.makedirs(dir_path, exist_ok=True)
+
+    total = len(members)
+    last_percent = -1
+
+    def member_done(done):
+        nonlocal last_percent
+        percent = 100 * done // total
+        if percent != last_percent:
+            last_percent = percent
+            on_progress(done, total)
+
+    extract_members(zip_path, members, on_done=member_done if on_progress and total else None)
+
+    # --- Создание новых папок (если указаны) ---
+    for dir_path in metadata.get('added_dirs', []):
+        try:
+            os.makedirs(safe_join(cwd, dir_path), exist_ok=True)
         except Exception as e:
-            print(f"[VERBOSE] Failed to read version: {e}")
-            self.finished.emit([], f"Не удалось прочитать версию: {e}")
-            return
-
+            print(f"[VERBOSE] Не удалось создать папку {dir_path}: {e}")
+
+    # --- Обновление версии ---
+    write_version(target_version, dirs)
+
+    # --- Удаление ZIP-архива ---
+    try:
+        os.remove(zip_path)
+    except Exception as e:
+        print(f"[WARN] Не удалось удалить временный архив {zip_path}: {e}")
+
+
+# Текущая версия из VERSION_FILE (0, если файла нет)
+def read_current_version():
+    if not os.path.exists(VERSION_FILE):
+        print("[VERBOSE] No version file. Assuming version 0.")
+        return 0
+    with open(VERSION_FILE, "r") as f:
+        current_version = int(f.read().strip() or "0")
+    print(f"[VERBOSE] Current version: {current_version}")
+    return current_version
+
+
+# Список обновлений новее current_version, по возрастанию версии
+def fetch_updates(current_version):
+    # Fetch update.json: no-cache заставляет CDN сверить версию с источником,
+    # а URL без ?t= остаётся кэшируемым и попадает в условный GET ниже
+    cached = load_update_json_cache()
+    headers = {"Cache-Control": "no-cache", "Pragma": "no-cache"}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    response = get_session().get(UPDATE_JSON_URL, headers=headers, timeout=10)
+
+    if response.status_code == 304 and "data" in cached:
+        print("[VERBOSE] update.json не изменился (304), берём из кэша")
+        version_map = cached["data"]
+    else:
+        response.raise_for_status()
+        version_map = orjson.loads(response.content) if orjson is not None else response.json()
+        save_update_json_cache(response, version_map)
+
+    # Collect all versions > current_version
+    available_versions = []
+    for ver_str, link in version_map.items():
         try:
-            # Fetch update.json (no cache-busting needed in URL string itself)
+            ver_int = int(ver_str)
+            if ver_int > current_version and link and isinstance(link, str) and link.strip().startswith("http"):
+                available_versions.append((ver_int, link.strip()))
+        except (ValueError, TypeError):
+            continue
 
-            cache_buster_url = f"{UPDATE_JSON_URL}?t={int(time.time())}"
-            response = requests.get(cache_buster_url, timeout=10)
-            
-            response.raise_for_status()
-            version_map = response.json()
+    # Sort by version number
+    available_versions.sort(key=lambda x: x[0])
 
-            # Collect all versions > current_version
-            available_versions = []
-            for ver_str, link in version_map.items():
-                try:
-                    ver_int = int(ver_str)
-                    if ver_int > current_version and link and isinstance(link, str) and link.strip().startswith("http"):
-                        available_versions.append((ver_int, link.strip()))
-                except (ValueError, TypeError):
-                    continue
+    update_list = []
+    for ver_int, link in available_versions:
+        update_list.append({
+            "version": ver_int,
+            "link": link,
+            "current_version": current_version  # will be updated later, but not used
+        })
 
-            # Sort by version number
-            available_versions.sort(key=lambda x: x[0])
+    if update_list:
+        print(f"[VERBOSE] Found {len(update_list)} updates: {[u['version'] for u in update_list]}")
+    return update_list
 
-            if not available_versions:
-                self.finished.emit([], "")
-                return
 
-            update_list = []
-            for ver_int, link in available_versions:
-                update_list.append({
-                    "version": ver_int,
-                    "link": link,
-                    "current_version": current_version  # will be updated later, but not used
-                })
+# Синхронная проверка без виджета и пула потоков: хост-приложение может решить,
+# показывать ли апдейтер вообще. Модуль при этом всё равно импортирует PyQt5.
+# Ошибки сети пробрасываются вызывающему
+def check_once():
+    return fetch_updates(read_current_version())
 
-            print(f"[VERBOSE] Found {len(update_list)} updates: {[u['version'] for u in update_list]}")
-            self.finished.emit(update_list, "")
 
-        except Exception as e:
-            error_msg = f"Ошибка при загрузке списка обновлений: {e}"
-            print(f"[VERBOSE] {error_msg}")
-            self.finished.emit([], error_msg)
+# QRunnable не QObject — сигналы живут в отдельном объекте
+class UpdateWorkerSignals(QObject):
+    finished = pyqtSignal(list, str)  # Now emits list of updates
+    current_version_fetched = pyqtSignal(int)
 
 
-class YandexDownloaderThread(QThread):
+class DownloaderSignals(QObject):
     progress = pyqtSignal(int)
     finished = pyqtSignal(str)
     failed = pyqtSignal(str)
     slow_speed_detected = pyqtSignal()
 
+
+class ApplySignals(QObject):
+    progress = pyqtSignal(int, int)  # (распаковано, всего)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str, bool)  # (ошибка, архив битый)
+
+
+# Задачи идут в общий QThreadPool — поток не создаётся заново на каждую операцию
+class UpdateWorker(QRunnable):
+    def __init__(self):
+        super().__init__()
+        self.setAutoDelete(False)  # ссылку держит UpdaterWidget
+        self.signals = UpdateWorkerSignals()
+
+
+    def run(self):
+        print("[VERBOSE] Starting update check (fetching from GitHub)...")
+        try:
+            current_version = read_current_version()
+            self.signals.current_version_fetched.emit(current_version)
+        except Exception as e:
+            print(f"[VERBOSE] Failed to read version: {e}")
+            self.signals.finished.emit([], f"Не удалось прочитать версию: {e}")
+            return
+
+        try:
+            update_list = fetch_updates(current_version)
+            self.signals.finished.emit(update_list, "")
+        except Exception as e:
+            error_msg = f"Ошибка при загрузке списка обновлений: {e}"
+            print(f"[VERBOSE] {error_msg}")
+            self.signals.finished.emit([], error_msg)
+
+
+class YandexDownloaderThread(QRunnable):
     def __init__(self, yandex_url, save_path):
         super().__init__()
+        self.setAutoDelete(False)  # ссылку держит UpdaterWidget
+        self.signals = DownloaderSignals()
         self.yandex_url = yandex_url
         self.save_path = save_path
-        self._last_bytes = 0
-        self._last_time = None
-        self._slow_counter = 0
+        self.part_path = save_path + ".part"  # недокачанный файл; переименовывается по готовности
+        # Параллельная загрузка пишет в свой файл: он заранее растянут до полного размера
+        # и заполнен вразнобой, поэтому его размер — не число полученных байтов и докачке он не подлежит
+        self.ranged_path = save_path + ".ranged"
+        self._total = 0
+        self._lock = threading.Lock()
 
     def run(self):
         try:
@@ -120,101 +647,289 @@ class YandexDownloaderThread(QThread):
             elif "disk.yandex.ru" in clean_url or "yadi.sk" in clean_url:
                 api_url = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
                 params = {"public_key": clean_url}
-                response = requests.get(api_url, params=params, timeout=10)
+                response = get_session().get(api_url, params=params, timeout=10)
                 if response.status_code != 200:
-                    self.failed.emit(f"Yandex API error: {response.status_code}")
+                    self.signals.failed.emit(f"Yandex API error: {response.status_code}")
                     return
                 direct_url = response.json().get("href")
             else:
                 direct_url = clean_url
 
             if not direct_url:
-                self.failed.emit("Yandex не вернул ссылку для скачивания")
+                self.signals.failed.emit("Yandex не вернул ссылку для скачивания")
                 return
 
-            r = requests.get(direct_url, stream=True, timeout=60)
-            r.raise_for_status()
+            # Разреженный файл прерванной параллельной загрузки ничего не стоит — удаляем
+            force_remove(self.ranged_path)
+
+            # Остался хвост прошлой попытки — докачиваем его одним потоком, а не заново
+            resume = os.path.exists(self.part_path) and os.path.getsize(self.part_path) > 0
+
+            ranged = False
+            if not resume:
+                final_url, total, ranged = self._probe_ranges(direct_url)
+                ranged = ranged and total >= RANGE_MIN_SIZE
+
+            if ranged:
+                try:
+                    self._download_ranged(final_url, total)
+                except RangeNotSupported:
+                    print("[VERBOSE] Сервер проигнорировал Range, качаем одним потоком")
+                    force_remove(self.ranged_path)
+                    ranged = False
+                except BaseException:
+                    # Куски записаны вразнобой — такой файл докачать нельзя
+                    force_remove(self.ranged_path)
+                    raise
+            if not ranged:
+                self._download_stream(direct_url)
+
+            if ranged and os.path.getsize(self.ranged_path) != total:
+                force_remove(self.ranged_path)
+                raise IOError(f"Размер скачанного файла не совпал с ожидаемым ({total} байт)")
+            os.replace(self.ranged_path if ranged else self.part_path, self.save_path)
+            self.signals.progress.emit(100)
+            self.signals.finished.emit(self.save_path)
 
-            total = int(r.headers.get('content-length', 0))
-            downloaded = 0
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+
+    # Размер файла и поддержка Range: сначала HEAD (заодно проходим редиректы);
+    # если HEAD не отвечает или молчит про Range (но не отказывает явно) — пробный GET первого байта
+    def _probe_ranges(self, url):
+        head = get_session().head(url, allow_redirects=True, timeout=10)
+        total = int(head.headers.get('content-length', 0))
+        accept = head.headers.get('accept-ranges', '').lower()
+        if head.ok and accept == 'bytes':
+            return head.url, total, True
+        if accept == 'none' or (head.ok and 0 < total < RANGE_MIN_SIZE):
+            return url, total, False  # делить всё равно не будем
+
+        probe = get_session().get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=10)
+        probe.close()
+        content_range = probe.headers.get('content-range', '')
+        if probe.status_code == 206 and '/' in content_range:
+            size = content_range.rsplit('/', 1)[1]
+            if size.isdigit():
+                return probe.url, int(size), True
+        return url, total, False
+
+    def _reset_progress(self, total, done=0):
+        self._total = total
+        self._downloaded = done
+        self._last_percent = -1
+        self._last_emit_ns = 0
+        self._last_sample = done >> SPEED_SAMPLE_SHIFT
+        self._last_bytes = done
+        self._last_ns = time.monotonic_ns()
+        self._ema_kbps = None
+        self._slow_counter = 0
 
-            with open(self.save_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=65536):
-                    if chunk:
+    # Вызывается из любого потока загрузки: учёт байтов, скорости и процента
+    def _add_progress(self, n):
+        with self._lock:
+            self._downloaded += n
+            downloaded = self._downloaded
+
+            # Часы читаем только при пересечении границы выборки; скорость — целочисленное EMA
+            sample = downloaded >> SPEED_SAMPLE_SHIFT
+            if sample != self._last_sample:
+                self._last_sample = sample
+                now_ns = time.monotonic_ns()
+                elapsed_ns = now_ns - self._last_ns
+                if elapsed_ns >= 1_000_000_000:
+                    kbps = ((downloaded - self._last_bytes) >> 10) * 1_000_000_000 // elapsed_ns
+                    if self._ema_kbps is None:
+                        self._ema_kbps = kbps
+                    else:
+                        self._ema_kbps = (self._ema_kbps * 7 + kbps) // 8
+                    if self._ema_kbps <= SLOW_SPEED_KBPS:
+                        self._slow_counter += 1
+                    else:
+                        self._slow_counter = 0
+
+                    if self._slow_counter >= 3:
+                        self.signals.slow_speed_detected.emit()
+
+                    self._last_bytes = downloaded
+                    self._last_ns = now_ns
+
+            if self._total > 0:
+                percent = min(99, int(100 * downloaded / self._total))
+            else:
+                mb = downloaded // (1024 * 1024)
+                percent = min(99, max(1, mb))
+
+            # Сигнал в GUI-поток — только когда процент изменился, и не чаще раза в PROGRESS_INTERVAL_NS
+            if percent != self._last_percent:
+                now_ns = time.monotonic_ns()
+                if now_ns - self._last_emit_ns >= PROGRESS_INTERVAL_NS:
+                    self.signals.progress.emit(percent)
+                    self._last_percent = percent
+                    self._last_emit_ns = now_ns
+
+    # Последовательная загрузка с докачкой: размер .part на диске и есть число полученных байтов,
+    # поэтому здесь файл заранее не резервируется
+    def _download_stream(self, url):
+        existing = os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+        headers = {'Range': f'bytes={existing}-'} if existing else {}
+        r = get_session().get(url, headers=headers, stream=True, timeout=60)
+
+        if existing and r.status_code == 416:
+            # Всё уже скачано, если сервер называет тот же размер
+            r.close()
+            if r.headers.get('content-range', '').endswith(f'/{existing}'):
+                return
+            existing = 0
+            r = get_session().get(url, stream=True, timeout=60)
+
+        r.raise_for_status()
+        if r.status_code != 206:
+            existing = 0  # Range не поддержан — начинаем сначала
+        self._reset_progress(existing + int(r.headers.get('content-length', 0)), existing)
+        if existing:
+            print(f"[VERBOSE] Докачка с {existing} байт")
+
+        # На медленном канале блоки по 64 КБ — копим их в буфере и пишем мегабайтами
+        with open(self.part_path, 'ab' if existing else 'wb', buffering=DOWNLOAD_CHUNK_MAX) as f:
+            for chunk in self._iter_body(r):
+                f.write(chunk)
+                self._add_progress(len(chunk))
+
+    # Чтение тела ответа с адаптивным размером блока: на быстром канале блоки растут
+    # до DOWNLOAD_CHUNK_MAX (меньше итераций Python), на медленном — уменьшаются,
+    # чтобы прогресс и детектор медленной скорости не замирали
+    def _iter_body(self, r):
+        size = DOWNLOAD_CHUNK_SIZE if self._total > 100 * 1024 * 1024 else DOWNLOAD_CHUNK_MIN
+        while True:
+            start = time.monotonic()
+            chunk = r.raw.read(size, decode_content=True)
+            if not chunk:
+                # urllib3 1.x с gzip/deflate может вернуть b'' посреди потока,
+                # пока распаковщик копит вход — конец тела только когда поток закрыт
+                if r.raw.closed:
+                    break
+                continue
+            yield chunk
+            elapsed = time.monotonic() - start
+            if elapsed < 0.25 and size < DOWNLOAD_CHUNK_MAX:
+                size *= 2
+            elif elapsed > 0.5 and size > DOWNLOAD_CHUNK_MIN:
+                size //= 2
+
+    # Параллельная загрузка по Range: каждый поток пишет свой диапазон по своему смещению
+    def _download_ranged(self, url, total, conns=RANGE_CONNECTIONS):
+        self._reset_progress(total)
+        with open(self.ranged_path, 'wb') as f:
+            preallocate(f, total)
+
+        # Кусков больше, чем соединений: быстрые потоки добирают хвост за медленными
+        step = max(RANGE_CHUNK_MIN, -(-total // (conns * RANGE_CHUNKS_PER_CONN)))
+        ranges = [(lo, min(lo + step, total) - 1) for lo in range(0, total, step)]
+
+        # Файл заранее растянут нулями, поэтому оборванный ответ не оставит дыры только если
+        # считать байты: недостающий хвост куска запрашиваем заново, а не публикуем нули
+        def fetch_range(lo, hi):
+            pos = lo
+            for attempt in range(RANGE_ATTEMPTS):
+                r = get_session().get(url, headers={'Range': f'bytes={pos}-{hi}'}, stream=True, timeout=60)
+                r.raise_for_status()
+                if r.status_code != 206:
+                    r.close()
+                    raise RangeNotSupported(r.status_code)
+                with open(self.ranged_path, 'r+b', buffering=DOWNLOAD_CHUNK_MAX) as f:
+                    f.seek(pos)
+                    for chunk in self._iter_body(r):
+                        chunk = chunk[:hi + 1 - pos]  # лишнее затёрло бы соседний кусок
                         f.write(chunk)
-                        downloaded += len(chunk)
-
-                        now = time.time()
-                        if self._last_time is None:
-                            self._last_time = now
-                            self._last_bytes = downloaded
-                        else:
-                            elapsed = now - self._last_time
-                            if elapsed >= 1.0:
-                                bytes_diff = downloaded - self._last_bytes
-                                speed_kb_s = (bytes_diff / 1024) / elapsed
-                                if speed_kb_s <= 200:
-                                    self._slow_counter += 1
-                                else:
-                                    self._slow_counter = 0
-
-                                if self._slow_counter >= 3:
-                                    self.slow_speed_detected.emit()
-
-                                self._last_bytes = downloaded
-                                self._last_time = now
-
-                        if total > 0:
-                            percent = min(99, int(100 * downloaded / total))
-                            self.progress.emit(percent)
-                        else:
-                            mb = downloaded // (1024 * 1024)
-                            self.progress.emit(min(99, max(1, mb)))
-
-            self.progress.emit(100)
-            self.finished.emit(self.save_path)
+                        pos += len(chunk)
+                        self._add_progress(len(chunk))
+                        if pos > hi:
+                            break
+                r.close()
+                if pos > hi:
+                    return
+                print(f"[VERBOSE] Кусок {lo}-{hi} оборвался на {pos}, попытка {attempt + 1}/{RANGE_ATTEMPTS}")
+            raise IOError(f"Кусок {lo}-{hi} не докачан: получено {pos - lo} из {hi - lo + 1} байт")
+
+        pool = ThreadPoolExecutor(max_workers=conns)
+        try:
+            futures = [pool.submit(fetch_range, lo, hi) for lo, hi in ranges]
+            for future in as_completed(futures):
+                future.result()
+        finally:
+            # При первой ошибке оставшиеся куски не качаем
+            pool.shutdown(wait=True, cancel_futures=True)
 
+
+class ApplyWorker(QRunnable):
+    def __init__(self, zip_path, target_version):
+        super().__init__()
+        self.setAutoDelete(False)  # ссылку держит UpdaterWidget
+        self.signals = ApplySignals()
+        self.zip_path = zip_path
+        self.target_version = target_version
+
+    def run(self):
+        try:
+            apply_hard_update(self.zip_path, self.target_version, on_progress=self.signals.progress.emit)
+        except CORRUPT_ZIP_ERRORS as e:
+            self.signals.failed.emit(str(e), True)
+            return
         except Exception as e:
-            self.failed.emit(str(e))
+            self.signals.failed.emit(str(e), False)
+            return
+        self.signals.finished.emit()
+
+
+# Стиль окна — одна строка на модуль, а не новая копия в каждом экземпляре
+STYLESHEET = """
+    QWidget {
+        background-color: #ffffff;
+        color: #222222;
+        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+    }
+    QProgressBar {
+        border: 1px solid #d0d0d0;
+        border-radius: 4px;
+        text-align: center;
+        color: #444;
+        background: #f5f5f5;
+    }
+    QProgressBar::chunk {
+        background-color: #4a90e2;
+        border-radius: 3px;
+    }
+    QPushButton {
+        background-color: #4a90e2;
+        color: white;
+        border: none;
+        padding: 6px 16px;
+        border-radius: 4px;
+        font-weight: bold;
+    }
+    QPushButton:hover {
+        background-color: #357abd;
+    }
+"""
 
 
 class UpdaterWidget(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Автообновление")
-        self.setStyleSheet("""
-            QWidget {
-                background-color: #ffffff;
-                color: #222222;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            }
-            QProgressBar {
-                border: 1px solid #d0d0d0;
-                border-radius: 4px;
-                text-align: center;
-                color: #444;
-                background: #f5f5f5;
-            }
-            QProgressBar::chunk {
-                background-color: #4a90e2;
-                border-radius: 3px;
-            }
-            QPushButton {
-                background-color: #4a90e2;
-                color: white;
-                border: none;
-                padding: 6px 16px;
-                border-radius: 4px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #357abd;
-            }
-        """)
+        self.setStyleSheet(STYLESHEET)
         self.state = None
         self.pending_updates = []  # List of updates to apply
         self.current_update_index = 0
+        self.downloads = {}  # index -> {"thread", "path", "error"}
+        self.waiting_for = None  # index of the download the UI is waiting on
         self.slow_warning_button = None
+        self.apply_worker = None
+        self.busy = False  # идёт проверка или применение — повторный show не перезапускает
+        # Проверка, распаковка и предзагрузка могут идти одновременно даже на 1-2 ядрах
+        pool = QThreadPool.globalInstance()
+        pool.setMaxThreadCount(max(pool.maxThreadCount(), 4))
         self.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
 
     def sizeHint(self):
@@ -229,7 +944,8 @@ class UpdaterWidget(QWidget):
 
         if not self.layout():
             self._init_ui()
-        self.check_update()
+        if not self.busy:
+            self.check_update()
 
     def _init_ui(self):
         layout = QVBoxLayout()
@@ -274,10 +990,11 @@ class UpdaterWidget(QWidget):
         self.setLayout(layout)
 
     def check_update(self):
+        self.busy = True
         self.worker = UpdateWorker()
-        self.worker.current_version_fetched.connect(self.update_current_label)
-        self.worker.finished.connect(self.on_check_finished)
-        self.worker.start()
+        self.worker.signals.current_version_fetched.connect(self.update_current_label)
+        self.worker.signals.finished.connect(self.on_check_finished)
+        QThreadPool.globalInstance().start(self.worker)
         self.status_label.setText("Проверка обновлений…")
         self.progress_bar.setValue(0)
 
@@ -285,6 +1002,8 @@ class UpdaterWidget(QWidget):
         self.current_label.setText(f"Текущая версия: {ver}")
 
     def on_check_finished(self, update_list, error):
+        if error or not update_list:
+            self.busy = False
         if error:
             self.status_label.setText(f"<b style='color:#d32f2f;'>Ошибка:</b> {error}")
             return
@@ -300,11 +1019,13 @@ class UpdaterWidget(QWidget):
 
         self.pending_updates = update_list
         self.current_update_index = 0
+        self.downloads = {}
         self.apply_next_update()
 
     def apply_next_update(self):
         if self.current_update_index >= len(self.pending_updates):
             # All updates applied
+            self.busy = False
             final_ver = self.pending_updates[-1]["version"] if self.pending_updates else "unknown"
             self.status_label.setText(f"<b style='color:#388e3c;'>✅ Все обновления применены! Версия: v{final_ver}</b>")
             self.progress_bar.setValue(100)
@@ -324,15 +1045,61 @@ class UpdaterWidget(QWidget):
         self.progress_bar.setFormat("0%")
         self.slow_warning_button.setVisible(False)
 
-        zip_name = f"update_v{logical_ver}.zip"
-        self.downloader = YandexDownloaderThread(yandex_link, zip_name)
-        self.downloader.progress.connect(self.on_progress)
-        self.downloader.finished.connect(self.on_zip_downloaded)
-        self.downloader.failed.connect(
-            lambda e: self.status_label.setText(f"<b style='color:#d32f2f;'>Ошибка загрузки v{logical_ver}:</b> {e}")
-        )
-        self.downloader.slow_speed_detected.connect(self.on_slow_speed_detected)
-        self.downloader.start()
+        index = self.current_update_index
+        entry = self.downloads.get(index)
+        if entry is None or entry["error"]:
+            # Не было предзагрузки (или она упала) — качаем как обычно
+            self.start_download(index)
+        elif entry["path"]:
+            # Архив уже скачан, пока применялось предыдущее обновление
+            self.on_zip_downloaded(entry["path"])
+            return
+        self.waiting_for = index
+
+    def start_download(self, index):
+        update_info = self.pending_updates[index]
+        zip_name = f"update_v{update_info['version']}.zip"
+        downloader = YandexDownloaderThread(update_info["link"], zip_name)
+        self.downloads[index] = {"thread": downloader, "path": None, "error": None}
+        downloader.signals.progress.connect(lambda p, i=index: self.on_download_progress(i, p))
+        downloader.signals.finished.connect(lambda path, i=index: self.on_download_finished(i, path))
+        downloader.signals.failed.connect(lambda e, i=index: self.on_download_failed(i, e))
+        downloader.signals.slow_speed_detected.connect(lambda i=index: self.on_download_slow(i))
+        QThreadPool.globalInstance().start(downloader)
+
+    # Следующие архивы качаем, пока применяется текущий: по одному за раз (не делим канал),
+    # но без пауз — очередная загрузка стартует, как только закончилась предыдущая
+    def prefetch_next(self):
+        if any(e["path"] is None and e["error"] is None for e in self.downloads.values()):
+            return
+        last = min(self.current_update_index + PREFETCH_DEPTH, len(self.pending_updates) - 1)
+        for index in range(self.current_update_index + 1, last + 1):
+            if index not in self.downloads:
+                self.start_download(index)
+                return
+
+    def on_download_progress(self, index, percent):
+        if index == self.waiting_for:
+            self.on_progress(percent)
+
+    def on_download_slow(self, index):
+        if index == self.waiting_for:
+            self.on_slow_speed_detected()
+
+    def on_download_finished(self, index, zip_path):
+        self.downloads[index]["path"] = zip_path
+        if index == self.waiting_for:
+            self.waiting_for = None
+            self.on_zip_downloaded(zip_path)
+        else:
+            self.prefetch_next()
+
+    def on_download_failed(self, index, error):
+        self.downloads[index]["error"] = error
+        if index == self.waiting_for:
+            self.busy = False
+            logical_ver = self.pending_updates[index]["version"]
+            self.status_label.setText(f"<b style='color:#d32f2f;'>Ошибка загрузки v{logical_ver}:</b> {error}")
 
     def on_slow_speed_detected(self):
         self.status_label.setText(
@@ -346,135 +1113,68 @@ class UpdaterWidget(QWidget):
         self.progress_bar.setValue(percent)
         self.progress_bar.setFormat(f"{percent}%")
 
-        def on_zip_downloaded(self, zip_path):
+    def on_zip_downloaded(self, zip_path):
         update_info = self.pending_updates[self.current_update_index]
         target_version = update_info["version"]
 
         if "retry_count" not in update_info:
             update_info["retry_count"] = 0
 
-        max_retries = 2
-
         self.status_label.setText(f"Применение обновления v{target_version}…")
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("0%")
 
-        try:
-            with zipfile.ZipFile(zip_path, 'r') as zipf:
-                if 'update_metadata.json' not in zipf.namelist():
-                    raise ValueError("Архив обновления повреждён: отсутствует update_metadata.json")
-
-                metadata = json.loads(zipf.read('update_metadata.json'))
-
-                # --- Удаление старых файлов и папок ---
-                for file in metadata.get('deleted_files', []):
-                    fp = (Path.cwd() / file).resolve()
-                    try:
-                        if fp.exists():
-                            force_remove(str(fp))
-                    except Exception as e:
-                        print(f"[VERBOSE] Не удалось удалить файл {fp}: {e}")
-
-                for dir_path in metadata.get('deleted_dirs', []):
-                    dp = (Path.cwd() / dir_path).resolve()
-                    try:
-                        if dp.exists():
-                            force_remove(str(dp))
-                    except Exception as e:
-                        print(f"[VERBOSE] Не удалось удалить папку {dp}: {e}")
-
-                # --- Найдём snapshot, если есть ---
-                snapshot_file = next(
-                    (name for name in zipf.namelist()
-                     if name.startswith('snapshot_') and name.endswith('.json')),
-                    None
-                )
-
-                # --- Извлечение новых файлов ---
-                for zip_info in zipf.infolist():
-                    filename = zip_info.filename
-
-                    # Пропускаем метафайлы
-                    if filename in ('update_metadata.json', snapshot_file or ''):
-                        continue
-
-                    # 🔒 Пропускаем всё, что содержит скрытые/системные компоненты пути
-                    parts = Path(filename).parts
-                    if any(part.startswith('.') for part in parts):
-                        print(f"[VERBOSE] Пропущен скрытый путь: {filename}")
-                        continue
-
-                    # Защита от path traversal
-                    target = (Path.cwd() / filename).resolve()
-                    try:
-                        target.relative_to(Path.cwd())
-                    except ValueError:
-                        print(f"[WARN] Подозрительный путь вне рабочей директории: {filename}")
-                        continue
-
-                    if not zip_info.is_dir():
-                        try:
-                            if target.exists():
-                                force_remove(str(target))
-                            target.parent.mkdir(parents=True, exist_ok=True)
-                            zipf.extract(zip_info, path=Path.cwd())
-                        except Exception as e:
-                            print(f"[VERBOSE] Ошибка при извлечении {filename}: {e}")
-                            raise  # если не удалось — считаем обновление битым
-
-                # --- Создание новых папок (если указаны) ---
-                for dir_path in metadata.get('added_dirs', []):
-                    try:
-                        (Path.cwd() / dir_path).mkdir(parents=True, exist_ok=True)
-                    except Exception as e:
-                        print(f"[VERBOSE] Не удалось создать папку {dir_path}: {e}")
-
-                # --- Обновление версии ---
-                with open(VERSION_FILE, 'w') as f:
-                    f.write(str(target_version))
-
-                # --- Удаление ZIP-архива ---
-                try:
-                    os.remove(zip_path)
-                except Exception as e:
-                    print(f"[WARN] Не удалось удалить временный архив {zip_path}: {e}")
+        # Распаковка — в пуле потоков, чтобы окно не замирало на больших архивах
+        self.apply_worker = ApplyWorker(zip_path, target_version)
+        self.apply_worker.signals.progress.connect(self.on_apply_progress)
+        self.apply_worker.signals.finished.connect(lambda v=target_version: self.on_apply_finished(v))
+        self.apply_worker.signals.failed.connect(lambda e, corrupt, p=zip_path: self.on_apply_failed(p, e, corrupt))
+        QThreadPool.globalInstance().start(self.apply_worker)
+        self.prefetch_next()
+
+    def on_apply_progress(self, done, total):
+        self.on_progress(min(99, int(100 * done / total)) if total else 0)
+
+    def on_apply_finished(self, target_version):
+        # --- Переход к следующему обновлению ---
+        self.current_label.setText(f"Текущая версия: {target_version}")
+        self.current_update_index += 1
+        self.apply_next_update()
 
-                # --- Переход к следующему обновлению ---
-                self.current_label.setText(f"Текущая версия: {target_version}")
-                self.current_update_index += 1
-                self.apply_next_update()
+    def on_apply_failed(self, zip_path, e, corrupt):
+        update_info = self.pending_updates[self.current_update_index]
+        target_version = update_info["version"]
+        max_retries = 2
 
-        except Exception as e:
-            # Удаляем битый ZIP
+        # Удаляем только битый ZIP; целый архив применяем повторно без новой загрузки
+        if corrupt:
             try:
                 if os.path.exists(zip_path):
                     os.remove(zip_path)
             except Exception as cleanup_err:
                 print(f"[WARN] Не удалось удалить архив после ошибки: {cleanup_err}")
 
-            update_info["retry_count"] += 1
+        update_info["retry_count"] += 1
 
-            if update_info["retry_count"] <= max_retries:
+        if update_info["retry_count"] <= max_retries:
+            if corrupt or not os.path.exists(zip_path):
                 self.status_label.setText(
                     f"<b style='color:#f57c00;'>⚠️ Ошибка при распаковке v{target_version} (попытка {update_info['retry_count']}/3). "
                     f"Перезагрузка обновления…</b>"
                 )
                 # Повторная загрузка
-                yandex_link = update_info["link"]
-                zip_name = f"update_v{target_version}.zip"
-                self.downloader = YandexDownloaderThread(yandex_link, zip_name)
-                self.downloader.progress.connect(self.on_progress)
-                self.downloader.finished.connect(self.on_zip_downloaded)
-                self.downloader.failed.connect(
-                    lambda err: self.status_label.setText(f"<b style='color:#d32f2f;'>Ошибка загрузки v{target_version}:</b> {err}")
-                )
-                self.downloader.slow_speed_detected.connect(self.on_slow_speed_detected)
-                self.downloader.start()
+                self.start_download(self.current_update_index)
+                self.waiting_for = self.current_update_index
             else:
-                self.status_label.setText(
-                    f"<b style='color:#d32f2f;'>❌ Обновление v{target_version} не удалось после {max_retries + 1} попыток:</b> {str(e)}"
-                )
-                print(f"[ERROR] Постоянная ошибка обновления v{target_version}: {e}")
-                if self.state:
-                    self.state.wait = False
+                self.on_zip_downloaded(zip_path)
+        else:
+            self.status_label.setText(
+                f"<b style='color:#d32f2f;'>❌ Обновление v{target_version} не удалось после {max_retries + 1} попыток:</b> {e}"
+            )
+            print(f"[ERROR] Постоянная ошибка обновления v{target_version}: {e}")
+            self.busy = False
+            if self.state:
+                self.state.wait = False
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -1,23 +1,83 @@
 import os
 import hashlib
 import zipfile
+import zlib
 import json
-import subprocess
-from pathlib import Path
+import io
+import mmap
 import argparse
 import logging
 import re
+import fnmatch
 from datetime import datetime
 import shutil
+from collections import deque
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import importlib.metadata
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    from packaging.requirements import Requirement
+except ImportError:
+    Requirement = None
 
 # Configuration
-EXCLUDE_DIRS = {'venv', 'win_venv', '.venv', '.win_venv', 'browser/2', '_snapshots', '_update_ver', 'scrapers/2', ".git", "2"}
-EXCLUDE_PATTERNS = {'snapshot_*', 'update_*'}
-EXCLUDE_FILES = {'social.db', 'config.json', "upload_queue_backup.db"}
+EXCLUDE_DIRS = frozenset({'venv', 'win_venv', '.venv', '.win_venv', 'browser/2', '_snapshots', '_update_ver', 'scrapers/2', ".git", "2"})
+EXCLUDE_PATTERNS = frozenset({'snapshot_*', 'update_*'})
+EXCLUDE_FILES = frozenset({'social.db', 'config.json', "upload_queue_backup.db",
+                           '.coqui_upgrade_check'})  # server/updater.py's per-machine stamp
+# Multi-component entries of EXCLUDE_DIRS, as the walk spells them on this platform
+EXCLUDE_DIR_PATHS = frozenset(d.replace('/', os.sep) for d in EXCLUDE_DIRS if '/' in d)
+SNAPSHOT_NAME_RE = re.compile(r'^snapshot_(.+)_(\d+)\.json$')
+EXCLUDE_PATTERN_RE = re.compile('|'.join(fnmatch.translate(p) for p in EXCLUDE_PATTERNS))
 VERSION_FILE = 'version'
 SNAPSHOT_DIR = './_snapshots'
 UPDATE_DIR = './_update_ver'
-SNAPSHOT_BACKUP_DIR = './_snapshots_backup'
+HASH_BUFSIZE = 1024 * 1024
+MMAP_HASH_MIN = 8 * 1024 * 1024  # larger files are hashed through mmap
+# hashlib releases the GIL while hashing, so threads overlap disk reads; APFS contends past ~4
+HASH_WORKERS = 4 if sys.platform == 'darwin' else min(10, (os.cpu_count() or 1) * 2)
+PARALLEL_HASH_MIN = 32  # smaller trees are hashed inline, a pool is not worth starting
+COPY_BUFSIZE = 1024 * 1024
+# Already-compressed formats: deflate burns CPU for next to no gain, so they are STORED
+PRECOMPRESSED = frozenset({
+    '.zip', '.gz', '.tgz', '.xz', '.bz2', '.7z', '.whl',
+    '.png', '.jpg', '.jpeg', '.webp', '.gif',
+    '.mp3', '.mp4', '.webm', '.ogg', '.opus', '.flac',
+    '.safetensors', '.pt', '.bin', '.onnx',
+})
+# Deflate level for package members (zlib's 0-9, -1 = its default of 6); lower builds faster
+ZIP_LEVEL = int(os.environ.get('UPDATER_ZIP_LEVEL', zlib.Z_DEFAULT_COMPRESSION))
+PARALLEL_DEFLATE_MAX = 16 * 1024 * 1024  # larger files stream through add_to_zip instead of memory
+DEFLATE_WINDOW = 2 * HASH_WORKERS  # deflated payloads held in memory while the zip writer catches up
+# write_raw_member uses ZipFile internals (_lock, _writecheck, _didModify, start_dir, NameToInfo)
+# checked against these CPython releases; other versions go through the public zipfile API
+RAW_MEMBER_PYTHONS = ((3, 8), (3, 13))
+RAW_MEMBER_SUPPORTED = RAW_MEMBER_PYTHONS[0] <= sys.version_info[:2] <= RAW_MEMBER_PYTHONS[1]
+# Tooling pip-chill leaves out of its output unless --all is given
+PIP_CHILL_HIDDEN = frozenset({'pip', 'pip-chill', 'setuptools', 'wheel', 'distribute'})
+REQUIREMENT_NAME_RE = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]*')
+# SHA-256 unless UPDATER_HASH opts into blake3 (several times faster) or another hashlib name;
+# snapshots record which was used, so switching only costs one rehash of the tree
+CHECKSUM_ALGORITHM = os.environ.get('UPDATER_HASH') or 'sha256'
+if CHECKSUM_ALGORITHM == 'blake3' and blake3 is None:
+    raise ImportError("UPDATER_HASH=blake3 needs the blake3 package")
+BLAKE3_THREADED_MIN = 16 * 1024 * 1024  # from here on blake3 also splits one file across threads
+# One cache per algorithm, so rehashing for an older snapshot does not evict the current one
+CHECKSUM_CACHE = os.path.join(SNAPSHOT_DIR, 'checksum_cache_{algorithm}.json')
+# Files touched this close to the snapshot may change again within the same mtime tick
+CHECKSUM_CACHE_RACY_NS = 2_000_000_000
 
 # Setup logging with more detailed format
 logging.basicConfig(
@@ -50,96 +110,214 @@ def get_current_version():
         logging.error(f"Failed to read version file: {e}")
         raise
 
-def should_exclude(path):
-    """Check if a path should be excluded from snapshot."""
-    try:
-        rel_path = os.path.relpath(path)
-        path_obj = Path(rel_path)
-
-        # Check if full path or parent starts with excluded dir
-        for excluded in EXCLUDE_DIRS:
-            if rel_path == str(excluded) or rel_path.startswith(str(excluded) + os.sep):
-                return True
-
-        # Check if any path part matches excluded dir names
-        if any(part in EXCLUDE_DIRS for part in path_obj.parts):
-            return True
+def should_exclude_file(name):
+    """Check a single path component against the excluded names and patterns."""
+    return name in EXCLUDE_DIRS or name in EXCLUDE_FILES or EXCLUDE_PATTERN_RE.match(name) is not None
 
-        # Check if file name is in EXCLUDE_FILES
-        if path_obj.name in EXCLUDE_FILES:
-            return True
-
-        # Exclude patterns like snapshot_*, update_*
-        if any(path_obj.match(pattern) for pattern in EXCLUDE_PATTERNS):
-            return True
-
-        return False
-    except Exception as e:
-        logging.error(f"Error checking exclusion for {path}: {e}")
-        return True  # Exclude on error to be safe
+def should_exclude_dir(rel_path, name):
+    """Check a directory before descending; its parents were already checked by the walk."""
+    return should_exclude_file(name) or rel_path in EXCLUDE_DIR_PATHS
 
-def get_file_checksum(filepath):
-    """Compute SHA256 checksum of a file."""
-    hash_sha256 = hashlib.sha256()
+def get_file_checksum(filepath, algorithm=CHECKSUM_ALGORITHM):
+    """Compute the checksum of a file with algorithm ('blake3' or a hashlib name)."""
     try:
         with open(filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(chunk)
-        return hash_sha256.hexdigest()
+            size = os.fstat(f.fileno()).st_size
+            if algorithm == 'blake3':
+                hasher = blake3(max_threads=blake3.AUTO if size >= BLAKE3_THREADED_MIN else 1)
+            elif size < MMAP_HASH_MIN and hasattr(hashlib, 'file_digest'):
+                # Python 3.11+: read + update loop runs in C
+                return hashlib.file_digest(f, algorithm).hexdigest()
+            else:
+                hasher = hashlib.new(algorithm)
+
+            if size >= MMAP_HASH_MIN:
+                # Hash straight from the page cache, no copy into Python buffers
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    hasher.update(mm)
+                return hasher.hexdigest()
+
+            buf = bytearray(HASH_BUFSIZE)
+            view = memoryview(buf)
+            while n := f.readinto(buf):
+                hasher.update(view[:n])
+            return hasher.hexdigest()
     except Exception as e:
         logging.error(f"Failed to compute checksum for {filepath}: {e}")
         raise
 
-def get_pip_freeze():
-    """Get list of installed Python packages using pip-chill."""
+def read_json(path):
+    """Parse a JSON file with orjson when available, else json."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def write_json(path, data, indent=False):
+    """Write data as JSON: one orjson buffer when available, else json.dump's chunked writes.
+
+    The file is written next to path and renamed over it, so readers never see a partial file.
+    """
+    tmp_path = path + '.tmp'
     try:
-        result = subprocess.run(['pip-chill'], capture_output=True, text=True, check=True)
-        return result.stdout.splitlines()
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to run pip-chill: {e}")
+        if orjson is not None:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0))
+        else:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2 if indent else None)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise
+
+def load_checksum_cache(algorithm):
+    """Load {rel_path: [size, mtime_ns, checksum]} from the last run; empty if missing or another algorithm."""
+    cache_path = CHECKSUM_CACHE.format(algorithm=algorithm)
+    try:
+        cache = read_json(cache_path)
     except FileNotFoundError:
-        logging.error("pip-chill not found. Ensure it is installed.")
-        raise
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable checksum cache {cache_path}: {e}")
+        return {}
+    if not isinstance(cache, dict) or cache.get('algorithm') != algorithm:
+        return {}
+    return cache.get('files', {})
+
+def save_checksum_cache(files, algorithm):
+    """Atomically replace the CHECKSUM_CACHE of algorithm."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    write_json(CHECKSUM_CACHE.format(algorithm=algorithm), {'algorithm': algorithm, 'files': files})
+
+def get_cached_checksum(filepath, cached, algorithm):
+    """Return (size, mtime_ns, checksum), hashing only when size or mtime differ from cached."""
+    st = os.stat(filepath)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached
+    return [st.st_size, st.st_mtime_ns, get_file_checksum(filepath, algorithm)]
+
+def checksum_files(pending, algorithm, use_cache=True):
+    """Checksum (rel_path, path) pairs on HASH_WORKERS threads, reusing cached checksums.
+
+    Returns {rel_path: checksum}; files that vanish meanwhile are left out with a warning.
+    """
+    # Unchanged files (same size and mtime as last run) reuse their checksum
+    cache = load_checksum_cache(algorithm) if use_cache else {}
+    started_ns = time.time_ns()
+
+    def checksum(item):
+        rel_path, filepath = item
+        try:
+            return get_cached_checksum(filepath, cache.get(rel_path), algorithm)
+        except FileNotFoundError:
+            logging.warning(f"File vanished while hashing, skipped: {rel_path}")
+            return None
 
-def create_snapshot(version):
-    """Create a snapshot of the current project state."""
+    if len(pending) < PARALLEL_HASH_MIN:
+        entries = map(checksum, pending)
+    else:
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            entries = list(pool.map(checksum, pending))
+
+    checksums = {}
+    new_cache = {}
+    for (rel_path, _), entry in zip(pending, entries):
+        if entry is None:
+            continue
+        checksums[rel_path] = entry[2]
+        if entry[1] < started_ns - CHECKSUM_CACHE_RACY_NS:
+            new_cache[rel_path] = entry
+    save_checksum_cache(new_cache, algorithm)
+    return checksums
+
+def distribution_key(name):
+    """Lowercase project name with runs of other characters as '-', as pip-chill prints it."""
+    return re.sub(r'[^A-Za-z0-9.]+', '-', name).lower()
+
+def required_by_others(distributions):
+    """Keys of the distributions some installed distribution depends on (extras not counted)."""
+    required = set()
+    for dist in distributions:
+        for spec in dist.requires or ():
+            if Requirement is not None:
+                try:
+                    req = Requirement(spec)
+                except ValueError:
+                    continue
+                if req.marker is not None and not req.marker.evaluate({'extra': ''}):
+                    continue
+                required.add(distribution_key(req.name))
+            else:
+                # Without packaging, only extras can be told apart from the marker text
+                if 'extra' in spec.partition(';')[2]:
+                    continue
+                name = REQUIREMENT_NAME_RE.match(spec)
+                if name:
+                    required.add(distribution_key(name.group()))
+    return required
+
+def get_pip_freeze():
+    """Get the top-level installed packages as name==version, like pip-chill, from importlib.metadata."""
+    distributions = [d for d in importlib.metadata.distributions() if d.metadata['Name']]
+    required = required_by_others(distributions)
+    packages = {}
+    for dist in distributions:
+        key = distribution_key(dist.metadata['Name'])
+        if key not in required and key not in PIP_CHILL_HIDDEN:
+            packages.setdefault(key, f"{key}=={dist.version}")
+    return [packages[key] for key in sorted(packages)]
+
+def walk_project(top='.'):
+    """Walk top with os.scandir, pruning excluded directories before descending.
+
+    Returns (directories, files) relative to top; files are (rel_path, path) pairs.
+    """
+    directories = []
+    files = []
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(top, rel_dir) if rel_dir else top)
+        except OSError as e:
+            # Same as os.walk: an unreadable directory is skipped, not fatal
+            logging.warning(f"Skipping unreadable directory {rel_dir or top}: {e}")
+            continue
+        with it:
+            for entry in it:
+                rel_path = rel_dir + os.sep + entry.name if rel_dir else entry.name
+                # DirEntry caches the type from readdir, so no extra stat per entry
+                if entry.is_dir():
+                    # Symlinked directories are not followed, as with os.walk
+                    if not entry.is_symlink() and not should_exclude_dir(rel_path, entry.name):
+                        directories.append(rel_path)
+                        stack.append(rel_path)
+                elif not should_exclude_file(entry.name):
+                    files.append((rel_path, entry.path))
+    return directories, files
+
+def create_snapshot(version, algorithm=CHECKSUM_ALGORITHM, use_cache=True):
+    """Create a snapshot of the current project state; use_cache=False rehashes every file."""
     snapshot = {
         'version': version,
         'timestamp': datetime.now().isoformat(),
+        'checksum_algorithm': algorithm,
         'files': {},
         'directories': [],
         'pip': get_pip_freeze()
     }
 
     try:
-        for root, dirs, files in os.walk('.'):
-            # Skip excluded directories
-            dirs[:] = [d for d in dirs if not should_exclude(os.path.join(root, d))]
-
-            rel_root = os.path.relpath(root)
-            if rel_root != '.' and not should_exclude(rel_root):
-                snapshot['directories'].append(rel_root)
-
-            for file in files:
-                filepath = os.path.join(root, file)
-                if should_exclude(filepath):
-                    continue
-                rel_path = os.path.relpath(filepath)
-                snapshot['files'][rel_path] = get_file_checksum(filepath)
+        directories, pending = walk_project()
+        snapshot['directories'] = directories
+        snapshot['files'] = checksum_files(pending, algorithm, use_cache)
 
         os.makedirs(SNAPSHOT_DIR, exist_ok=True)
         snapshot_name = os.path.join(SNAPSHOT_DIR, f'snapshot_{version}_{int(datetime.now().timestamp())}.json')
-
-        # Backup existing snapshot if it exists
-        if os.path.exists(snapshot_name):
-            os.makedirs(SNAPSHOT_BACKUP_DIR, exist_ok=True)
-            backup_path = os.path.join(SNAPSHOT_BACKUP_DIR, f'snapshot_{version}_{int(datetime.now().timestamp())}_backup.json')
-            shutil.copy2(snapshot_name, backup_path)
-            logging.info(f"Backed up existing snapshot to {backup_path}")
-
-        with open(snapshot_name, 'w') as f:
-            json.dump(snapshot, f, indent=2)
+        write_json(snapshot_name, snapshot, indent=True)
 
         return snapshot_name
     except Exception as e:
@@ -149,8 +327,7 @@ def create_snapshot(version):
 def load_snapshot(snapshot_path):
     """Load a snapshot file and validate it."""
     try:
-        with open(snapshot_path, 'r') as f:
-            data = json.load(f)
+        data = read_json(snapshot_path)
         # Validate snapshot structure
         required_keys = {'version', 'files', 'directories', 'pip'}
         if not all(key in data for key in required_keys):
@@ -161,20 +338,24 @@ def load_snapshot(snapshot_path):
         raise
 
 def list_snapshots():
-    """List all available snapshots with version and timestamp."""
+    """List all available snapshots with version and timestamp, taken from the file names."""
     snapshots = []
-    if os.path.exists(SNAPSHOT_DIR):
-        for fname in os.listdir(SNAPSHOT_DIR):
-            if fname.startswith('snapshot_') and fname.endswith('.json'):
-                try:
-                    snapshot_path = os.path.join(SNAPSHOT_DIR, fname)
-                    with open(snapshot_path, 'r') as f:
-                        data = json.load(f)
-                    version = data.get('version', 'unknown')
-                    timestamp = data.get('timestamp', 'unknown')
-                    snapshots.append((snapshot_path, version, timestamp))
-                except Exception as e:
-                    logging.warning(f"Skipping invalid snapshot {fname}: {e}")
+    try:
+        it = os.scandir(SNAPSHOT_DIR)
+    except FileNotFoundError:
+        return snapshots
+    with it:
+        for entry in it:
+            # create_snapshot names them snapshot_{version}_{unix_ts}.json; the JSON is
+            # only loaded (and validated) once one is selected
+            match = SNAPSHOT_NAME_RE.match(entry.name)
+            if not match:
+                if entry.name.startswith('snapshot_') and entry.name.endswith('.json'):
+                    logging.warning(f"Skipping snapshot with unexpected name {entry.name}")
+                continue
+            version, ts = match.groups()
+            timestamp = datetime.fromtimestamp(int(ts)).isoformat()
+            snapshots.append((entry.path, version, timestamp))
     return sorted(snapshots, key=lambda x: x[2], reverse=True)  # Sort by timestamp
 
 def select_snapshot():
@@ -202,65 +383,190 @@ def select_snapshot():
         except ValueError:
             print("Please enter a valid number.")
 
-def create_update_package(new_version, full=False):
-    """Create update package using diff between selected snapshot and current state."""
+def add_to_zip(zipf, filepath):
+    """Add a file to zipf: STORED via copy_into if already compressed, else streamed through deflate."""
+    if os.path.splitext(filepath)[1].lower() in PRECOMPRESSED:
+        add_stored_to_zip(zipf, filepath)
+        return
+    zip_info = zipfile.ZipInfo.from_file(filepath)
+    zip_info.compress_type = zipfile.ZIP_DEFLATED
+    # Not zipf.write(): it copies through a fixed 8 KiB buffer. Python 3.13 renamed
+    # the per-member level from _compresslevel to compress_level
+    if hasattr(zip_info, 'compress_level'):
+        zip_info.compress_level = ZIP_LEVEL
+    else:
+        zip_info._compresslevel = ZIP_LEVEL
+    # file_size is known from the stat above, so zip64 is chosen automatically
+    with open(filepath, 'rb') as src, zipf.open(zip_info, 'w') as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+def add_stored_to_zip(zipf, filepath):
+    """Add a file as a STORED member; the CRC comes from an mmap, the bytes from copy_into."""
+    if not RAW_MEMBER_SUPPORTED:
+        zipf.write(filepath, compress_type=zipfile.ZIP_STORED)
+        return
+    zip_info = zipfile.ZipInfo.from_file(filepath)
+    zip_info.compress_type = zipfile.ZIP_STORED
+    with open(filepath, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        crc = 0
+        if size:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                crc = zlib.crc32(mm)
+        zip_info.file_size = zip_info.compress_size = size
+        zip_info.CRC = crc
+        write_raw_member(zipf, zip_info, src)
+
+def copy_into(src, dst, count):
+    """Copy count bytes from the start of src to dst's position, in the kernel via os.sendfile if possible."""
+    if hasattr(os, 'sendfile'):
+        dst.flush()
+        start = dst.tell()
+        offset = 0
+        try:
+            while offset < count:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, count - offset)
+                if not sent:
+                    raise OSError(f"{src.name} shrank while being added to the zip")
+                offset += sent
+            dst.seek(start + count)
+            return
+        except (OSError, io.UnsupportedOperation):
+            # e.g. macOS, where sendfile only writes to sockets; retry the copy in Python
+            if offset:
+                raise
+            dst.seek(start)
+    src.seek(0)
+    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+def deflate_file(filepath):
+    """Read and raw-deflate a whole file on a worker thread; zlib releases the GIL meanwhile."""
+    zip_info = zipfile.ZipInfo.from_file(filepath)
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    compressor = zlib.compressobj(ZIP_LEVEL, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush()
+    if len(payload) < len(data):
+        zip_info.compress_type = zipfile.ZIP_DEFLATED
+    else:
+        zip_info.compress_type = zipfile.ZIP_STORED
+        payload = data
+    zip_info.file_size = len(data)
+    zip_info.compress_size = len(payload)
+    zip_info.CRC = zlib.crc32(data)
+    return zip_info, payload
+
+def write_raw_member(zipf, zip_info, payload):
+    """Append a member whose CRC and sizes are already set; zipfile has no public API for this.
+
+    payload is the compressed bytes, or an open file copied as-is for STORED members.
+    Only valid where RAW_MEMBER_SUPPORTED.
+    """
+    with zipf._lock:
+        zipf._writecheck(zip_info)
+        zipf._didModify = True
+        zip_info.header_offset = zipf.fp.tell()
+        zipf.fp.write(zip_info.FileHeader())
+        if isinstance(payload, bytes):
+            zipf.fp.write(payload)
+        else:
+            copy_into(payload, zipf.fp, zip_info.compress_size)
+        zipf.filelist.append(zip_info)
+        zipf.NameToInfo[zip_info.filename] = zip_info
+        zipf.start_dir = zipf.fp.tell()
+
+def add_files_to_zip(zipf, files):
+    """Add files to zipf, deflating the small compressible ones in parallel."""
+    if not RAW_MEMBER_SUPPORTED:
+        for filepath in files:
+            add_to_zip(zipf, filepath)
+        return
+
+    small = []
+    for filepath in files:
+        if (os.path.splitext(filepath)[1].lower() in PRECOMPRESSED
+                or os.path.getsize(filepath) > PARALLEL_DEFLATE_MAX):
+            add_to_zip(zipf, filepath)
+        else:
+            small.append(filepath)
+
+    # Members are written in submission order; at most DEFLATE_WINDOW files are in flight
+    # so payloads cannot pile up in memory when the writer is slower than the workers
+    window = deque()
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        for filepath in small:
+            if len(window) >= DEFLATE_WINDOW:
+                write_raw_member(zipf, *window.popleft().result())
+            window.append(pool.submit(deflate_file, filepath))
+        while window:
+            write_raw_member(zipf, *window.popleft().result())
+
+def create_update_package(new_version, full=False, new_snapshot_path=None):
+    """Create update package using diff between selected snapshot and current state.
+
+    Pass new_snapshot_path to reuse a snapshot already taken of the current state.
+    """
     timestamp = int(datetime.now().timestamp())
     suffix = "major" if full else "minor"
     zip_name = f"update_{suffix}_{timestamp}.zip"
     zip_path = os.path.join(UPDATE_DIR, zip_name)
 
-    # Create new snapshot (current state)
-    new_snapshot_path = create_snapshot(new_version)
+    if new_snapshot_path is None:
+        # Create new snapshot (current state)
+        new_snapshot_path = create_snapshot(new_version)
     new_snapshot_data = load_snapshot(new_snapshot_path)
 
-    # Select previous snapshot
-    old_snapshot_path, old_version = select_snapshot() if not full else (None, None)
-
-    if old_snapshot_path:
-        old_snapshot_data = load_snapshot(old_snapshot_path)
-    else:
-        old_snapshot_data = {'files': {}, 'directories': [], 'pip': []}
-        old_version = "any"
-
-    # Compute differences
-    old_files = old_snapshot_data['files']
-    new_files = new_snapshot_data['files']
-    old_dirs = set(old_snapshot_data.get('directories', []))
-    new_dirs = set(new_snapshot_data.get('directories', []))
-
-    added_files = []
-    modified_files = []
-    for file, checksum in new_files.items():
-        if file not in old_files:
-            added_files.append(file)
-        elif old_files[file] != checksum:
-            modified_files.append(file)
-
-    deleted_files = [f for f in old_files if f not in new_files]
-    added_dirs = list(new_dirs - old_dirs)
-    deleted_dirs = list(old_dirs - new_dirs)
-
-    # If --full, include everything
     if full:
-        added_files = list(new_files.keys())
+        added_dirs = list(new_snapshot_data['directories'])
+        added_files = list(new_snapshot_data['files'])
         modified_files = []
         deleted_files = []
-        added_dirs = list(new_dirs)
         deleted_dirs = []
+        old_snapshot_data = {'files': {}, 'directories': [], 'pip': []}
+        old_version = "any"
+    else:
+        # Select previous snapshot
+        old_snapshot_path, old_version = select_snapshot()
+
+        if old_snapshot_path:
+            old_snapshot_data = load_snapshot(old_snapshot_path)
+        else:
+            old_snapshot_data = {'files': {}, 'directories': [], 'pip': []}
+            old_version = "any"
+
+        # Compute differences
+        old_files = old_snapshot_data['files']
+        new_files = new_snapshot_data['files']
+        # Checksums only compare under one algorithm; snapshots without the tag are SHA-256
+        old_algorithm = old_snapshot_data.get('checksum_algorithm', 'sha256')
+        if new_snapshot_data.get('checksum_algorithm', 'sha256') != old_algorithm:
+            logging.info(f"Previous snapshot uses {old_algorithm}, rehashing current files to compare")
+            new_files = checksum_files([(f, f) for f in new_files], old_algorithm)
+        old_dirs = frozenset(old_snapshot_data.get('directories', []))
+        new_dirs = frozenset(new_snapshot_data.get('directories', []))
+
+        # Key views support set arithmetic in C; sorted so the metadata is deterministic
+        added_files = sorted(new_files.keys() - old_files.keys())
+        modified_files = sorted(f for f in new_files.keys() & old_files.keys() if new_files[f] != old_files[f])
+        deleted_files = sorted(old_files.keys() - new_files.keys())
+        added_dirs = sorted(new_dirs - old_dirs)
+        deleted_dirs = sorted(old_dirs - new_dirs)
 
     # Create update package
     try:
         os.makedirs(UPDATE_DIR, exist_ok=True)
         with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Include the new snapshot
-            zipf.write(new_snapshot_path, os.path.basename(new_snapshot_path))
-
             # Add changed files
+            present = []
             for file in added_files + modified_files:
                 if os.path.exists(file):
-                    zipf.write(file)
+                    present.append(file)
                 else:
                     logging.warning(f"File not found (but in snapshot): {file}")
+            add_files_to_zip(zipf, present)
+
+            # Include the new snapshot
+            zipf.write(new_snapshot_path, os.path.basename(new_snapshot_path))
 
             # Metadata
             metadata = {
@@ -287,6 +593,7 @@ def create_update_package(new_version, full=False):
 def main():
     parser = argparse.ArgumentParser(description="Create update package using manual version from ./version.")
     parser.add_argument('--full', action='store_true', help="Mark as major update (full package)")
+    parser.add_argument('--no-cache', action='store_true', help="Rehash every file instead of trusting the checksum cache")
     args = parser.parse_args()
 
     try:
@@ -294,11 +601,11 @@ def main():
         print(f"Using version from {VERSION_FILE}: {new_version}")
 
         # Create snapshot
-        snapshot_name = create_snapshot(new_version)
+        snapshot_name = create_snapshot(new_version, use_cache=not args.no_cache)
         print(f"Created snapshot: {snapshot_name}")
 
         # Create update package
-        zip_name = create_update_package(new_version, full=args.full)
+        zip_name = create_update_package(new_version, full=args.full, new_snapshot_path=snapshot_name)
         print(f"Created update package: {zip_name}")
     except Exception as e:
         logging.error(f"Script failed: {e}")
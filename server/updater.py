@@ -1,28 +1,56 @@
 import os
 import sys
 import json
+import importlib.metadata
 import re
+import html
+import zipfile
 import logging
+import functools
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import subprocess
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk
 from urllib.parse import urlencode
-from docx import Document
 import time
 import platform
-import psutil
 
 # --- Configuration ---
 VERSION_FILE = 'version'
 UPDATE_DIR = './_update_ver'
 VERSIONS_DOCX_URL = 'https://disk.yandex.ru/i/yWKvtV4nTA_txA'  # Public link to updates.docx
 VERSIONS_DOCX_PATH = 'update.docx'
+DOWNLOAD_WORKERS = 4  # update zips fetched at once; matches the session's pool size
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # big enough to cut loop overhead, small enough for smooth progress
+COQUI_UPGRADE_STAMP = '.coqui_upgrade_check'  # mtime = last successful 'pip install -U coqui-tts'
+COQUI_UPGRADE_INTERVAL = 24 * 3600  # the upgrade asks the package index, so once a day is enough
+
+# Update rules in the versions .docx: '1.0.0 -> 1.0.2, https://disk.yandex.ru/d/...'
+UPDATE_RULE = re.compile(r'(\d+\.\d+\.\d+)\s*->\s*(\d+\.\d+\.\d+)\s*,\s*(https://disk\.yandex\.ru/d/[\w-]+)')
+# Paragraph, table and text-box tags: python-docx's Document.paragraphs holds only the
+# paragraphs directly in the body, so anything inside a table or text box is skipped
+DOCX_BLOCK = re.compile(rb'<(/?)w:(p|tbl|txbxContent)(?=[\s/>])[^>]*?(/?)>')
+# Only <w:t> text, tabs and breaks are read, as python-docx does; field codes (<w:instrText>)
+# and deleted text (<w:delText>) never reach the paragraph text. A bare <w:tab/> is a tab
+# character; with attributes it is a tab stop in the paragraph properties
+DOCX_TEXT = re.compile(rb'<w:t(?:\s[^>]*)?>([^<]*)</w:t>|<w:(tab)/>|<w:(br|cr)(\s[^>]*)?/>')
+# Page and column breaks have no text; only line breaks become '\n'
+DOCX_PAGE_BREAK = re.compile(rb'\bw:type="(?:page|column)"')
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# One keep-alive session for the Yandex API and every download in the chain
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504], raise_on_status=False),
+))
+
 # Global root
 root = None
 
@@ -207,30 +235,44 @@ REQUIRED_PACKAGES = {
 }
 
 
-def fetch(public_key, write_as='update.docx'):
-    """Download file from Yandex Disk with progress."""
+def fetch_to(public_key, write_as='update.docx', progress_cb=None):
+    """Download file from Yandex Disk, reporting progress_cb(total, downloaded) per chunk."""
     api_url = 'https://cloud-api.yandex.net/v1/disk/public/resources/download?'
     download_url = api_url + urlencode({'public_key': public_key.strip()})
     try:
-        response = requests.get(download_url)
+        response = SESSION.get(download_url)
         response.raise_for_status()
         direct_url = response.json()['href']
 
-        with requests.get(direct_url, stream=True) as r:
+        with SESSION.get(direct_url, stream=True) as r:
             r.raise_for_status()
             total = int(r.headers.get('content-length', 0))
             downloaded = 0
-            with open(write_as, 'wb') as f:
-                for chunk in r.iter_content(4096):
+            # Chunks are already large, so they go straight to the file without stdio buffering
+            with open(write_as, 'wb', buffering=0) as f:
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
                     if chunk:
                         f.write(chunk)
                         downloaded += len(chunk)
-                        yield total, downloaded
+                        if progress_cb:
+                            progress_cb(total, downloaded)
     except Exception as e:
         logging.error(f"Download failed: {e}")
         raise
 
 
+def write_version(version):
+    """Atomically replace VERSION_FILE so a crash mid-write never leaves it empty."""
+    tmp = VERSION_FILE + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, f"{version}\n".encode('utf-8'))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, VERSION_FILE)
+
+
 def get_current_version():
     """Read current version from file."""
     try:
@@ -240,6 +282,7 @@ def get_current_version():
         return "0.0.0"
 
 
+@functools.lru_cache(maxsize=None)
 def version_to_tuple(version):
     """Convert version string to tuple for comparison."""
     try:
@@ -248,19 +291,63 @@ def version_to_tuple(version):
         return (0, 0, 0)
 
 
+def docx_body_paragraphs(xml):
+    """Yield each body-level <w:p> of document.xml, with any text box inside it cut out."""
+    nested = 0  # open tables/text boxes
+    parts = None  # pieces of the current body paragraph
+    pos = 0
+    for m in DOCX_BLOCK.finditer(xml):
+        closing, tag, empty = m.groups()
+        if tag == b'p':
+            if nested:
+                continue
+            if empty:
+                yield m.group()
+            elif closing:
+                if parts is not None:
+                    parts.append(xml[pos:m.end()])
+                    yield b''.join(parts)
+                parts = None
+            else:
+                parts, pos = [], m.start()
+        elif empty:
+            continue
+        elif closing:
+            nested -= 1
+            if not nested:
+                pos = m.end()
+        else:
+            if not nested and parts is not None:
+                parts.append(xml[pos:m.start()])
+            nested += 1
+
+
+def docx_paragraph_text(paragraph):
+    """Plain text of one <w:p> element, joined the way python-docx joins runs."""
+    parts = []
+    for text, tab, brk, attrs in DOCX_TEXT.findall(paragraph):
+        if tab:
+            parts.append(b'\t')
+        elif brk:
+            if not DOCX_PAGE_BREAK.search(attrs):
+                parts.append(b'\n')
+        else:
+            parts.append(text)
+    return html.unescape(b''.join(parts).decode('utf-8', 'replace'))
+
+
 def parse_versions_docx(path):
     """Parse update rules from docx: '1.0.0 -> 1.0.2,   https://disk.yandex.ru/d/...  '"""
     if not os.path.exists(path):
         logging.error(f"File not found: {path}")
         return []
     try:
-        doc = Document(path)
+        # A .docx is a zip; the paragraphs live in word/document.xml, no DOM needed
+        with zipfile.ZipFile(path) as z:
+            xml = z.read('word/document.xml')
         updates = []
-        for p in doc.paragraphs:
-            text = p.text.strip()
-            match = re.match(
-                r'(\d+\.\d+\.\d+)\s*->\s*(\d+\.\d+\.\d+)\s*,\s*(https://disk\.yandex\.ru/d/[\w-]+)',
-                text)
+        for paragraph in docx_body_paragraphs(xml):
+            match = UPDATE_RULE.match(docx_paragraph_text(paragraph).strip())
             if match:
                 updates.append(match.groups())
         return sorted(updates, key=lambda x: version_to_tuple(x[1]))
@@ -279,39 +366,72 @@ def get_updates_chain(current, updates):
     chain = []
     curr = current
     while True:
-        candidates = [
-            (fv, tv, url) for fv, tv, url in updates
-            if version_to_tuple(fv) <= version_to_tuple(curr)
-        ]
-        if not candidates:
-            break
-        best = max(candidates, key=lambda x: version_to_tuple(x[1]))
-        if version_to_tuple(best[1]) <= version_to_tuple(curr):
+        # One pass: the applicable rule that reaches the highest version past curr
+        curr_key = version_to_tuple(curr)
+        best = None
+        best_key = curr_key
+        for update in updates:
+            to_key = version_to_tuple(update[1])
+            if to_key > best_key and version_to_tuple(update[0]) <= curr_key:
+                best, best_key = update, to_key
+        if best is None:
             break
         chain.append(best)
         curr = best[1]
     return chain
 
 
+def canonical_name(name):
+    """Normalize a project name the way pip compares them (PEP 503)."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def installed_versions():
+    """Map canonical name -> version for every distribution in this environment."""
+    versions = {}
+    for dist in importlib.metadata.distributions():
+        name = dist.metadata['Name']
+        if name:
+            versions[canonical_name(name)] = dist.version
+    return versions
+
+
+def missing_packages(specs, installed):
+    """Return the 'name==version' specs not already installed at exactly that version."""
+    missing = []
+    for spec in specs:
+        name, _, version = spec.partition('==')
+        if installed.get(canonical_name(name)) != version:
+            missing.append(spec)
+    return missing
+
+
+def coqui_upgrade_due():
+    """True if coqui-tts was never upgraded here, or not within COQUI_UPGRADE_INTERVAL."""
+    try:
+        return time.time() - os.path.getmtime(COQUI_UPGRADE_STAMP) >= COQUI_UPGRADE_INTERVAL
+    except OSError:
+        return True
+
+
 def ensure_packages():
-    """Uninstall old packages and install required ones."""
+    """Uninstall old packages and install required ones that are missing or at another version."""
     logging.info("Checking and installing required packages...")
+    installed = installed_versions()
 
     # Uninstall old packages
+    removed = False
     for package in ["TTS", "tts-models", "coqpit"]:
+        if canonical_name(package) not in installed:
+            continue
         try:
             subprocess.run([sys.executable, "-m", "pip", "uninstall", "-y", package], check=True)
             logging.info(f"Uninstalled {package}")
+            removed = True
         except subprocess.CalledProcessError:
             logging.warning(f"Could not uninstall {package} (may not be installed)")
-
-    # Install coqpit-config and coqui-tts
-    try:
-        subprocess.run([sys.executable, "-m", "pip", "install", "coqpit-config"], check=True)
-        subprocess.run([sys.executable, "-m", "pip", "install", "-U", "coqui-tts"], check=True)
-        logging.info("Installed coqpit-config and updated coqui-tts")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to install coqui-tts or coqpit-config: {e}")
+    if removed:
+        installed = installed_versions()
 
     # Determine platform-specific packages
     system = platform.system().lower()
@@ -321,10 +441,34 @@ def ensure_packages():
     elif system == "linux":
         pkgs += REQUIRED_PACKAGES["linux_only"]
 
-    # Install all required packages
+    # Install coqpit-config if absent; keep coqui-tts upgraded as before, but only
+    # ask the index once per COQUI_UPGRADE_INTERVAL instead of on every start
+    try:
+        changed = False
+        if canonical_name("coqpit-config") not in installed:
+            subprocess.run([sys.executable, "-m", "pip", "install", "coqpit-config"], check=True)
+            logging.info("Installed coqpit-config")
+            changed = True
+        if coqui_upgrade_due():
+            subprocess.run([sys.executable, "-m", "pip", "install", "-U", "coqui-tts"], check=True)
+            with open(COQUI_UPGRADE_STAMP, 'w', encoding='utf-8') as f:
+                f.write(f"{time.time()}\n")
+            logging.info("Updated coqui-tts")
+            changed = True
+        if changed:
+            installed = installed_versions()
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.error(f"Failed to install coqui-tts or coqpit-config: {e}")
+
+    # Only hand pip the pins that are not already satisfied
+    pkgs = missing_packages(pkgs, installed)
+    if not pkgs:
+        logging.info("All required packages already installed.")
+        return
+
     try:
         subprocess.run([sys.executable, "-m", "pip", "install"] + pkgs, check=True)
-        logging.info("All required packages installed.")
+        logging.info(f"Installed {len(pkgs)} required package(s).")
     except subprocess.CalledProcessError as e:
         logging.error(f"Failed to install some packages: {e}")
 
@@ -352,7 +496,11 @@ def start_server_and_exit():
 
 
 def restart_updater():
-    """Robustly restart updater across Windows and macOS with retry and cleanup."""
+    """Restart updater with retry and cleanup.
+
+    POSIX: os.execv replaces this process (same PID). Windows: a new process is started in
+    this console's window and this one exits.
+    """
     global root
     max_attempts = 3
     retry_delay = 1  # seconds
@@ -383,35 +531,22 @@ def restart_updater():
             logging.info(f"Restart attempt {attempt + 1}/{max_attempts}")
 
             if platform.system() == "Windows":
+                # execv on Windows spawns a child and exits without waiting, which breaks the
+                # console; start a new process that stays on this console instead, so the new
+                # updater's output (and server_monitor.py's, which it starts) remains visible,
+                # with no pipes nobody would drain
                 subprocess.Popen(
                     cmd,
                     creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
+                    close_fds=True
                 )
-            else:
-                subprocess.Popen(
-                    cmd,
-                    start_new_session=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-
-            time.sleep(0.5)
-            current_process = psutil.Process(current_pid)
-            children = current_process.children(recursive=True)
-            if children:
-                try:
-                    current_process.terminate()
-                except:
-                    pass
                 sys.exit(0)
-            else:
-                logging.warning("New process not detected")
 
-        except Exception as e:
+            # Replace this process image in place: same PID, nothing to poll for
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.execv(python_exe, cmd)
+        except OSError as e:
             logging.error(f"Restart attempt {attempt + 1} failed: {e}")
 
         if attempt < max_attempts - 1:
@@ -455,8 +590,7 @@ class UpdaterApp:
 
             # Download versions file
             try:
-                for _ in fetch(VERSIONS_DOCX_URL, VERSIONS_DOCX_PATH):
-                    pass
+                fetch_to(VERSIONS_DOCX_URL, VERSIONS_DOCX_PATH)
             except Exception as e:
                 logging.error(f"Failed to download update list: {e}")
                 self.status_label.config(text="Network error. Starting app...")
@@ -484,22 +618,47 @@ class UpdaterApp:
             zip_files = []
             from_map = {}
             total = len(chain)
-
-            for i, (fv, tv, url) in enumerate(chain, 1):
-                self.status_label.config(text=f"Downloading {tv} ({i}/{total})...")
-                os.makedirs(UPDATE_DIR, exist_ok=True)
-                path = os.path.join(UPDATE_DIR, f'update_{tv}.zip')
-                try:
-                    for total_size, downloaded in fetch(url.strip(), path):
-                        if total_size:
-                            self.progress['value'] = downloaded / total_size * 100
-                        self.root.update_idletasks()
-                except Exception as e:
-                    logging.error(f"Download failed ({url}): {e}")
-                    continue
-                zip_files.append(path)
-                from_map[tv] = fv
-                self.progress['value'] = 0
+            os.makedirs(UPDATE_DIR, exist_ok=True)
+            self.status_label.config(text=f"Downloading {total} update(s)...")
+
+            # Downloads are network-bound, so the whole chain is fetched concurrently;
+            # the bar shows combined progress and is updated on the Tk thread
+            # Each archive counts equally: sizes arrive one by one as downloads start, and a
+            # byte-weighted total would fall back whenever another archive reports its size
+            fractions = [0.0] * total
+            progress_lock = threading.Lock()
+            last_percent = [-1]
+
+            def report(index, total_size, downloaded):
+                with progress_lock:
+                    if total_size:
+                        fractions[index] = min(1.0, downloaded / total_size)
+                    percent = int(sum(fractions) * 100 / total)
+                    # Never move the bar backwards
+                    if percent <= last_percent[0]:
+                        return
+                    last_percent[0] = percent
+                self.root.after(0, lambda: self.progress.configure(value=percent))
+
+            def download(index, url, path):
+                fetch_to(url.strip(), path, lambda t, d: report(index, t, d))
+                return path
+
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+                futures = []
+                for i, (fv, tv, url) in enumerate(chain):
+                    path = os.path.join(UPDATE_DIR, f'update_{tv}.zip')
+                    futures.append(pool.submit(download, i, url, path))
+
+                # Results are collected in chain order, so zip_files stays sorted by version
+                for (fv, tv, url), future in zip(chain, futures):
+                    try:
+                        zip_files.append(future.result())
+                    except Exception as e:
+                        logging.error(f"Download failed ({url}): {e}")
+                        continue
+                    from_map[tv] = fv
+            self.root.after(0, lambda: self.progress.configure(value=0))
 
             if not zip_files:
                 self.status_label.config(text="All downloads failed. Starting server...")
@@ -523,8 +682,7 @@ class UpdaterApp:
 
             # Save new version
             latest_ver = chain[-1][1]
-            with open(VERSION_FILE, 'w', encoding='utf-8') as f:
-                f.write(latest_ver + '\n')
+            write_version(latest_ver)
 
             # Restart updater
             self.status_label.config(text="Update applied. Restarting updater...")
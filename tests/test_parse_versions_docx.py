@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import docx
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import updater
+
+
+def add_field_run(paragraph, fld_type=None, instr=None):
+    run = paragraph.add_run()
+    if fld_type:
+        fld = OxmlElement('w:fldChar')
+        fld.set(qn('w:fldCharType'), fld_type)
+        run._r.append(fld)
+    if instr:
+        instr_text = OxmlElement('w:instrText')
+        instr_text.set(qn('xml:space'), 'preserve')
+        instr_text.text = instr
+        run._r.append(instr_text)
+    return run
+
+
+class ParseVersionsDocxTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'update.docx')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_plain_and_field_coded_hyperlink_rules(self):
+        url = 'https://disk.yandex.ru/d/field-link'
+        document = docx.Document()
+        document.add_paragraph('1.0.1 -> 1.0.2, https://disk.yandex.ru/d/plain-link')
+        paragraph = document.add_paragraph('1.0.2 -> 1.0.3, ')
+        add_field_run(paragraph, 'begin')
+        add_field_run(paragraph, instr=f' HYPERLINK "{url}" ')
+        add_field_run(paragraph, 'separate')
+        paragraph.add_run(url)
+        add_field_run(paragraph, 'end')
+        document.save(self.path)
+
+        self.assertEqual(updater.parse_versions_docx(self.path), [
+            ('1.0.1', '1.0.2', 'https://disk.yandex.ru/d/plain-link'),
+            ('1.0.2', '1.0.3', url),
+        ])
+
+    def test_matches_python_docx_paragraph_text(self):
+        document = docx.Document()
+        document.add_paragraph('1.0.0 -> 1.1.0, https://disk.yandex.ru/d/a&b')
+        paragraph = document.add_paragraph('tab')
+        paragraph.add_run().add_tab()
+        paragraph.add_run('and break')
+        paragraph.add_run().add_break()
+        paragraph.add_run('end')
+        document.add_table(rows=1, cols=1).cell(0, 0).text = '1.1.0 -> 1.2.0, https://disk.yandex.ru/d/cell'
+        document.add_paragraph('after table')
+        document.save(self.path)
+
+        expected = [p.text for p in docx.Document(self.path).paragraphs]
+        with updater.zipfile.ZipFile(self.path) as z:
+            xml = z.read('word/document.xml')
+        actual = [updater.docx_paragraph_text(p) for p in updater.docx_body_paragraphs(xml)]
+        self.assertEqual(actual, expected)
+
+    def test_text_boxes_and_break_types(self):
+        xml = (
+            b'<w:body><w:p><w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/></w:tabs></w:pPr>'
+            b'<w:r><w:t>outer</w:t></w:r>'
+            b'<w:r><w:drawing><wps:txbx><w:txbxContent>'
+            b'<w:p><w:r><w:t>inside box</w:t></w:r></w:p>'
+            b'</w:txbxContent></wps:txbx></w:drawing></w:r>'
+            b'<w:r><w:br w:type="textWrapping"/><w:t>rest</w:t><w:br w:type="page"/></w:r></w:p>'
+            b'<w:p/></w:body>'
+        )
+        actual = [updater.docx_paragraph_text(p) for p in updater.docx_body_paragraphs(xml)]
+        self.assertEqual(actual, ['outer\nrest', ''])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# snapshooter opens snapshooter.log in the working directory on import
+_cwd = os.getcwd()
+_log_dir = tempfile.mkdtemp()
+os.chdir(_log_dir)
+try:
+    import snapshooter
+finally:
+    os.chdir(_cwd)
+
+
+def tearDownModule():
+    logging_handlers = snapshooter.logging.getLogger().handlers
+    for handler in list(logging_handlers):
+        if getattr(handler, 'baseFilename', '').startswith(_log_dir):
+            handler.close()
+            snapshooter.logging.getLogger().removeHandler(handler)
+    shutil.rmtree(_log_dir, ignore_errors=True)
+
+
+class AddFilesToZipTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp.name)
+
+        os.makedirs('src/sub')
+        self.files = {
+            'src/empty.py': b'',
+            'src/text.py': b'print("hello")\n' * 2000,
+            'src/random.dat': os.urandom(5000),
+            'src/image.png': os.urandom(70000),
+            'src/sub/big.txt': b'0123456789abcdef' * 8192,
+        }
+        for i in range(snapshooter.DEFLATE_WINDOW * 3):
+            self.files[f'src/sub/f{i}.txt'] = f'file {i}\n'.encode() * (i + 1)
+        for path, data in self.files.items():
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def build(self):
+        # Small limit so big.txt takes the streamed path
+        with mock.patch.object(snapshooter, 'PARALLEL_DEFLATE_MAX', 64 * 1024):
+            with zipfile.ZipFile('out.zip', 'w', zipfile.ZIP_DEFLATED) as zipf:
+                snapshooter.add_files_to_zip(zipf, list(self.files))
+        return zipfile.ZipFile('out.zip')
+
+    def check(self, z, raw=True):
+        self.addCleanup(z.close)
+        self.assertIsNone(z.testzip())
+        self.assertEqual(sorted(z.namelist()), sorted(self.files))
+        for path, data in self.files.items():
+            self.assertEqual(z.read(path), data, path)
+        self.assertEqual(z.getinfo('src/image.png').compress_type, zipfile.ZIP_STORED)
+        if raw:
+            # deflate_file keeps a member STORED when deflate would not shrink it
+            self.assertEqual(z.getinfo('src/random.dat').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(z.getinfo('src/text.py').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(z.getinfo('src/sub/big.txt').compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_raw_members_on_this_interpreter(self):
+        # Fails here first if a new CPython release is added to RAW_MEMBER_PYTHONS untested
+        if not snapshooter.RAW_MEMBER_SUPPORTED:
+            self.skipTest(f"write_raw_member is not enabled on Python {sys.version_info[:2]}")
+        self.check(self.build())
+
+    def test_public_api_fallback(self):
+        with mock.patch.object(snapshooter, 'RAW_MEMBER_SUPPORTED', False):
+            self.check(self.build(), raw=False)
+
+    def test_deflate_window_bounds_pending_payloads(self):
+        if not snapshooter.RAW_MEMBER_SUPPORTED:
+            self.skipTest("parallel deflate needs write_raw_member")
+        in_flight = []
+        pending = [0]
+        deflate_file = snapshooter.deflate_file
+
+        def counting_deflate(filepath):
+            return deflate_file(filepath)
+
+        def counting_write(zipf, zip_info, payload, write=snapshooter.write_raw_member):
+            if isinstance(payload, bytes):  # STORED files pass an open file instead
+                pending[0] -= 1
+            write(zipf, zip_info, payload)
+
+        real_submit = snapshooter.ThreadPoolExecutor.submit
+
+        def submit(pool, fn, *args):
+            if fn is counting_deflate:
+                pending[0] += 1
+                in_flight.append(pending[0])
+            return real_submit(pool, fn, *args)
+
+        with mock.patch.object(snapshooter, 'deflate_file', counting_deflate), \
+                mock.patch.object(snapshooter, 'write_raw_member', counting_write), \
+                mock.patch.object(snapshooter.ThreadPoolExecutor, 'submit', submit):
+            self.check(self.build())
+        self.assertLessEqual(max(in_flight), snapshooter.DEFLATE_WINDOW)
+
+
+if __name__ == '__main__':
+    unittest.main()